@@ -1,38 +1,229 @@
 from fastmcp import FastMCP
 import sys
 import os
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, NamedTuple
 import fcntl
+import threading
+import functools
+import logging
+import math
 from pathlib import Path
 # Add project root directory to Python path
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, project_root)
 from tools.price_tools import get_yesterday_date, get_open_prices, get_yesterday_open_and_close_price, get_latest_position, get_yesterday_profit
 import json
-from tools.general_tools import get_config_value,write_config_value
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+from tools.general_tools import get_config_value,write_config_value,_resolve_runtime_env_path
 mcp = FastMCP("TradeTools")
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=32)
+def _sig_paths(signature: str) -> Tuple[Path, Path]:
+    """Return (lock_path, position_file_path) for a signature; pure path computation."""
+    base_dir = Path(project_root) / "data" / "agent_data" / signature
+    return base_dir / ".position.lock", base_dir / "position" / "position.jsonl"
+
+
+def _open_creating_parent(path: Path, mode: str):
+    """Open path for writing, creating its parent directory only if it is missing."""
+    try:
+        return open(path, mode)
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return open(path, mode)
+
+
+class _FilePositionLock:
+    """File-based lock to serialize position updates per signature across processes."""
+    def __init__(self, name: str):
+        self.lock_path = _sig_paths(name)[0]
+        # Ensure lock file exists
+        self._fh = _open_creating_parent(self.lock_path, "a+")
+    def __enter__(self):
+        fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        return self
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._fh.close()
+
+
+def _position_multiprocess() -> bool:
+    """Whether other processes may write the same signature's position.jsonl."""
+    return os.getenv("POSITION_MULTIPROCESS") == "1"
+
+
+# One in-process lock per signature, created on first use
+_sig_locks: Dict[str, threading.Lock] = {}
+_sig_locks_guard = threading.Lock()
 
 
 def _position_lock(signature: str):
-    """Context manager for file-based lock to serialize position updates per signature."""
-    class _Lock:
-        def __init__(self, name: str):
-            base_dir = Path(project_root) / "data" / "agent_data" / name
-            base_dir.mkdir(parents=True, exist_ok=True)
-            self.lock_path = base_dir / ".position.lock"
-            # Ensure lock file exists
-            self._fh = open(self.lock_path, "a+")
-        def __enter__(self):
-            fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
-            return self
-        def __exit__(self, exc_type, exc, tb):
-            try:
-                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
-            finally:
-                self._fh.close()
-    return _Lock(signature)
+    """Lock serializing position updates per signature.
+
+    Returns a cached threading.Lock by default. Set POSITION_MULTIPROCESS=1 when
+    several processes write the same signature to fall back to the fcntl file lock.
+    """
+    if _position_multiprocess():
+        return _FilePositionLock(signature)
+    with _sig_locks_guard:
+        return _sig_locks.setdefault(signature, threading.Lock())
+
+
+
+def _encode_record(record: Dict[str, Any]) -> bytes:
+    """Encode a transaction record as one JSONL line, using orjson when available.
+
+    Non-finite numbers are rejected with ValueError on both paths: orjson would
+    write NaN as null and json.dumps as NaN, and either breaks later trades.
+    """
+    for key, value in record["positions"].items():
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f"Refusing to record non-finite position value {key}={value}")
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record, allow_nan=False) + "\n").encode("utf-8")
+
+
+def _append_records(signature: str, records: List[Dict[str, Any]]) -> None:
+    """Append transaction records to a signature's position.jsonl with one write.
+
+    The file is opened per call rather than kept open, so a position.jsonl that was
+    deleted or recreated (e.g. by register_agent) is never written through a stale
+    handle. Callers must hold _position_lock(signature).
+    """
+    lines = []
+    for record in records:
+        # Serialize once; the log line only references fields of the record
+        lines.append(_encode_record(record))
+        logger.debug("Writing position record id=%s symbol=%s", record["id"], record["this_action"]["symbol"])
+    with _open_creating_parent(_sig_paths(signature)[1], "ab") as fh:
+        fh.writelines(lines)
+
+
+def _position_file_identity(signature: str) -> Optional[Tuple[int, int, int]]:
+    """(st_ino, st_size, st_mtime_ns) of a signature's position.jsonl, or None if it is missing."""
+    try:
+        st = os.stat(_sig_paths(signature)[1])
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class _PositionSnapshot(NamedTuple):
+    """Latest position written by this process for one signature."""
+    date: str
+    positions: Dict[str, Any]
+    action_id: int
+    # Identity of position.jsonl right after the write
+    file_identity: Optional[Tuple[int, int, int]]
+
+
+_position_snapshot: Dict[str, _PositionSnapshot] = {}
 
 
+def _store_position_snapshot(signature: str, today_date: str, positions: Dict[str, Any], action_id: int) -> None:
+    """Remember the position just appended, together with the file identity it produced.
+
+    A copy is stored, so the dict returned to tool callers never aliases the snapshot.
+    """
+    _position_snapshot[signature] = _PositionSnapshot(today_date, dict(positions), action_id, _position_file_identity(signature))
+
+
+def _latest_position(today_date: str, signature: str) -> Tuple[Dict[str, Any], int]:
+    """Same as get_latest_position, served from the in-process snapshot when possible.
+
+    The snapshot is only trusted for the date it was written on, when this process
+    is the only trade writer, and while position.jsonl still has the identity it had
+    right after our last write. Any other write (add_no_trade_record, register_agent,
+    a manual reset) changes that identity, and position.jsonl is scanned as before.
+    Callers must hold _position_lock(signature), must not mutate the result, and
+    must not return it to tool callers without copying.
+    """
+    snapshot = _position_snapshot.get(signature)
+    if (
+        snapshot is not None
+        and snapshot.date == today_date
+        and not _position_multiprocess()
+        and snapshot.file_identity is not None
+        and snapshot.file_identity == _position_file_identity(signature)
+    ):
+        return snapshot.positions, snapshot.action_id
+    return get_latest_position(today_date, signature)
+
+
+_merged_file = Path(project_root) / "data" / "merged.jsonl"
+
+
+def _merged_file_identity() -> Optional[Tuple[int, int]]:
+    """(st_mtime_ns, st_size) of data/merged.jsonl, or None if it is missing."""
+    try:
+        st = os.stat(_merged_file)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@functools.lru_cache(maxsize=8)
+def _load_prices(today_date: str, merged_identity: Tuple[int, int]) -> Dict[str, Optional[float]]:
+    """Opening prices of every symbol in merged.jsonl for a date, cached per file version."""
+    prices = get_open_prices(today_date, None, merged_path=str(_merged_file))
+    if not prices:
+        # No data for this date (yet); raise so the empty result is not cached
+        raise KeyError(today_date)
+    return prices
+
+
+def _prices_for_day(today_date: str) -> Dict[str, Optional[float]]:
+    """Opening prices of all symbols for a trading date, loaded once per date.
+
+    get_open_prices parses the whole merged.jsonl regardless of how many symbols
+    are requested, so every buy/sell on the same date shares one load. The cache is
+    keyed on merged.jsonl's stat as well, so regenerating the file reloads prices.
+    """
+    merged_identity = _merged_file_identity()
+    if merged_identity is None:
+        raise KeyError(today_date)
+    return _load_prices(today_date, merged_identity)
+
+
+def _runtime_env_identity() -> Optional[Tuple[int, int]]:
+    """(st_mtime_ns, st_size) of the runtime env file, or None if it cannot be stat'ed."""
+    try:
+        st = os.stat(_resolve_runtime_env_path())
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+# Per signature: (TODAY_DATE, runtime env file identity right after IF_TRADE was written)
+_if_trade_state: Dict[str, Tuple[str, Optional[Tuple[int, int]]]] = {}
+
+
+def _mark_traded(signature: str, today_date: str) -> None:
+    """Set IF_TRADE once per trading session instead of rewriting it on every trade.
+
+    The write is skipped only while the runtime env file is unchanged since our own
+    write, so a reset of IF_TRADE by main.py or the agent is never missed.
+    write_config_value only prints its errors, so the state is recorded only after
+    reading IF_TRADE back confirms the write landed; a failed write is retried on
+    the next trade.
+    """
+    state = _if_trade_state.get(signature)
+    current = _runtime_env_identity()
+    if current is None or state != (today_date, current):
+        write_config_value("IF_TRADE", True)
+        if get_config_value("IF_TRADE") is True:
+            _if_trade_state[signature] = (today_date, _runtime_env_identity())
+        else:
+            _if_trade_state.pop(signature, None)
+
 
 @mcp.tool()
 def buy(symbol: str, amount: int) -> Dict[str, Any]:
@@ -40,8 +231,8 @@ def buy(symbol: str, amount: int) -> Dict[str, Any]:
     Buy stock function
     
     This function simulates stock buying operations, including the following steps:
-    1. Get current position and operation ID
-    2. Get stock opening price for the day
+    1. Get stock opening price for the day
+    2. Get current position and operation ID
     3. Validate buy conditions (sufficient cash)
     4. Update position (increase stock quantity, decrease cash)
     5. Record transaction to position.jsonl file
@@ -56,7 +247,8 @@ def buy(symbol: str, amount: int) -> Dict[str, Any]:
           - Failure: Returns {"error": error message, ...} dictionary
         
     Raises:
-        ValueError: Raised when SIGNATURE environment variable is not set
+        ValueError: Raised when SIGNATURE environment variable is not set,
+            or when the new position would contain a non-finite value
         
     Example:
         >>> result = buy("AAPL", 10)
@@ -71,63 +263,56 @@ def buy(symbol: str, amount: int) -> Dict[str, Any]:
     # Get current trading date from environment variable
     today_date = get_config_value("TODAY_DATE")
     
-    # Step 2: Get current latest position and operation ID
-    # get_latest_position returns two values: position dictionary and current maximum operation ID
-    # This ID is used to ensure each operation has a unique identifier
-    # Acquire lock for atomic read-modify-write on positions
+    # Step 2: Get stock opening price for the day
+    # Use _prices_for_day to get the opening price of specified stock for the day
+    # If stock symbol does not exist or price data is missing, KeyError exception will be raised
+    # Price data does not depend on positions, so it is read before taking the lock
+    try:
+        this_symbol_price = _prices_for_day(today_date)[f'{symbol}_price']
+    except KeyError:
+        # Stock symbol does not exist or price data is missing, return error message
+        return {"error": f"Symbol {symbol} not found! This action will not be allowed.", "symbol": symbol, "date": today_date}
+
+    # Acquire lock once for atomic read-modify-write on positions:
+    # the position read, validation and record append happen in the same short critical section
     with _position_lock(signature):
+        # Step 3: Get current latest position and operation ID
+        # _latest_position returns two values: position dictionary and current maximum operation ID
+        # This ID is used to ensure each operation has a unique identifier
         try:
-            current_position, current_action_id = get_latest_position(today_date, signature)
+            current_position, current_action_id = _latest_position(today_date, signature)
         except Exception as e:
             print(e)
             print(today_date, signature)
             return {"error": f"Failed to load latest position: {e}", "symbol": symbol, "date": today_date}
-    # Step 3: Get stock opening price for the day
-    # Use get_open_prices function to get the opening price of specified stock for the day
-    # If stock symbol does not exist or price data is missing, KeyError exception will be raised
-    try:
-        this_symbol_price = get_open_prices(today_date, [symbol])[f'{symbol}_price']
-    except KeyError:
-        # Stock symbol does not exist or price data is missing, return error message
-        return {"error": f"Symbol {symbol} not found! This action will not be allowed.", "symbol": symbol, "date": today_date}
 
-    # Step 4: Validate buy conditions
-    # Calculate cash required for purchase: stock price × buy quantity
-    try:
-        cash_left = current_position["CASH"] - this_symbol_price * amount
-    except Exception as e:
-        print(current_position, "CASH", this_symbol_price, amount)
-
-    # Check if cash balance is sufficient for purchase
-    if cash_left < 0:
-        # Insufficient cash, return error message
-        return {"error": "Insufficient cash! This action will not be allowed.", "required_cash": this_symbol_price * amount, "cash_available": current_position.get("CASH", 0), "symbol": symbol, "date": today_date}
-    else:
+        # Step 4: Validate buy conditions
+        # Calculate cash required for purchase: stock price × buy quantity
+        try:
+            cash_left = current_position["CASH"] - this_symbol_price * amount
+        except Exception as e:
+            print(current_position, "CASH", this_symbol_price, amount)
+
+        # Check if cash balance is sufficient for purchase
+        if cash_left < 0:
+            # Insufficient cash, return error message
+            return {"error": "Insufficient cash! This action will not be allowed.", "required_cash": this_symbol_price * amount, "cash_available": current_position.get("CASH", 0), "symbol": symbol, "date": today_date}
+
         # Step 5: Execute buy operation, update position
-        # Create a copy of current position to avoid directly modifying original data
-        new_position = current_position.copy()
-        
-        # Decrease cash balance
-        new_position["CASH"] = cash_left
-        
-        # Increase stock position quantity
-        new_position[symbol] += amount
+        # Build the new position in one pass without modifying original data:
+        # decrease cash balance and increase stock position quantity
+        new_position = {**current_position, "CASH": cash_left, symbol: current_position[symbol] + amount}
         
         # Step 6: Record transaction to position.jsonl file
-        # Build file path: {project_root}/data/agent_data/{signature}/position/position.jsonl
-        # Use append mode ("a") to write new transaction record
+        # Records are appended to {project_root}/data/agent_data/{signature}/position/position.jsonl
         # Each operation ID increments by 1, ensuring uniqueness of operation sequence
-        position_file_path = os.path.join(project_root, "data", "agent_data", signature, "position", "position.jsonl")
-        # os.makedirs(os.path.dirname(position_file_path), exist_ok=True)
-        with _position_lock(signature):
-            with open(position_file_path, "a") as f:
-                # Write JSON format transaction record, containing date, operation ID, transaction details and updated position
-                print(f"Writing to position.jsonl: {json.dumps({'date': today_date, 'id': current_action_id + 1, 'this_action':{'action':'buy','symbol':symbol,'amount':amount},'positions': new_position})}")
-                f.write(json.dumps({"date": today_date, "id": current_action_id + 1, "this_action":{"action":"buy","symbol":symbol,"amount":amount},"positions": new_position}) + "\n")
-        # Step 7: Return updated position
-        write_config_value("IF_TRADE", True)
-        print("IF_TRADE", get_config_value("IF_TRADE"))
-        return new_position
+        # JSON format transaction record, containing date, operation ID, transaction details and updated position
+        record = {"date": today_date, "id": current_action_id + 1, "this_action":{"action":"buy","symbol":symbol,"amount":amount},"positions": new_position}
+        _append_records(signature, [record])
+        _store_position_snapshot(signature, today_date, new_position, current_action_id + 1)
+    # Step 7: Return updated position
+    _mark_traded(signature, today_date)
+    return new_position
 
 @mcp.tool()
 def sell(symbol: str, amount: int) -> Dict[str, Any]:
@@ -135,8 +320,8 @@ def sell(symbol: str, amount: int) -> Dict[str, Any]:
     Sell stock function
     
     This function simulates stock selling operations, including the following steps:
-    1. Get current position and operation ID
-    2. Get stock opening price for the day
+    1. Get stock opening price for the day
+    2. Get current position and operation ID
     3. Validate sell conditions (position exists, sufficient quantity)
     4. Update position (decrease stock quantity, increase cash)
     5. Record transaction to position.jsonl file
@@ -151,7 +336,8 @@ def sell(symbol: str, amount: int) -> Dict[str, Any]:
           - Failure: Returns {"error": error message, ...} dictionary
         
     Raises:
-        ValueError: Raised when SIGNATURE environment variable is not set
+        ValueError: Raised when SIGNATURE environment variable is not set,
+            or when the new position would contain a non-finite value
         
     Example:
         >>> result = sell("AAPL", 10)
@@ -166,57 +352,151 @@ def sell(symbol: str, amount: int) -> Dict[str, Any]:
     # Get current trading date from environment variable
     today_date = get_config_value("TODAY_DATE")
     
-    # Step 2: Get current latest position and operation ID under lock
-    # get_latest_position returns two values: position dictionary and current maximum operation ID
-    # This ID is used to ensure each operation has a unique identifier
-    with _position_lock(signature):
-        current_position, current_action_id = get_latest_position(today_date, signature)
-    
-    # Step 3: Get stock opening price for the day
-    # Use get_open_prices function to get the opening price of specified stock for the day
+    # Step 2: Get stock opening price for the day
+    # Use _prices_for_day to get the opening price of specified stock for the day
     # If stock symbol does not exist or price data is missing, KeyError exception will be raised
+    # Price data does not depend on positions, so it is read before taking the lock
     try:
-        this_symbol_price = get_open_prices(today_date, [symbol])[f'{symbol}_price']
+        this_symbol_price = _prices_for_day(today_date)[f'{symbol}_price']
     except KeyError:
         # Stock symbol does not exist or price data is missing, return error message
         return {"error": f"Symbol {symbol} not found! This action will not be allowed.", "symbol": symbol, "date": today_date}
 
-    # Step 4: Validate sell conditions
-    # Check if holding this stock
-    if symbol not in current_position:
-        return {"error": f"No position for {symbol}! This action will not be allowed.", "symbol": symbol, "date": today_date}
+    # Acquire lock once for atomic read-modify-write on positions:
+    # the position read, validation and record append happen in the same short critical section
+    with _position_lock(signature):
+        # Step 3: Get current latest position and operation ID
+        # _latest_position returns two values: position dictionary and current maximum operation ID
+        # This ID is used to ensure each operation has a unique identifier
+        current_position, current_action_id = _latest_position(today_date, signature)
 
-    # Check if position quantity is sufficient for selling
-    if current_position[symbol] < amount:
-        return {"error": "Insufficient shares! This action will not be allowed.", "have": current_position.get(symbol, 0), "want_to_sell": amount, "symbol": symbol, "date": today_date}
+        # Step 4: Validate sell conditions
+        # Check if holding this stock
+        if symbol not in current_position:
+            return {"error": f"No position for {symbol}! This action will not be allowed.", "symbol": symbol, "date": today_date}
 
-    # Step 5: Execute sell operation, update position
-    # Create a copy of current position to avoid directly modifying original data
-    new_position = current_position.copy()
-    
-    # Decrease stock position quantity
-    new_position[symbol] -= amount
-    
-    # Increase cash balance: sell price × sell quantity
-    # Use get method to ensure CASH field exists, default to 0 if not present
-    new_position["CASH"] = new_position.get("CASH", 0) + this_symbol_price * amount
-
-    # Step 6: Record transaction to position.jsonl file
-    # Build file path: {project_root}/data/agent_data/{signature}/position/position.jsonl
-    # Use append mode ("a") to write new transaction record
-    # Each operation ID increments by 1, ensuring uniqueness of operation sequence
-    position_file_path = os.path.join(project_root, "data", "agent_data", signature, "position", "position.jsonl")
-    # os.makedirs(os.path.dirname(position_file_path), exist_ok=True)
-    with _position_lock(signature):
-        with open(position_file_path, "a") as f:
-            # Write JSON format transaction record, containing date, operation ID and updated position
-            print(f"Writing to position.jsonl: {json.dumps({'date': today_date, 'id': current_action_id + 1, 'this_action':{'action':'sell','symbol':symbol,'amount':amount},'positions': new_position})}")
-            f.write(json.dumps({"date": today_date, "id": current_action_id + 1, "this_action":{"action":"sell","symbol":symbol,"amount":amount},"positions": new_position}) + "\n")
+        # Check if position quantity is sufficient for selling
+        if current_position[symbol] < amount:
+            return {"error": "Insufficient shares! This action will not be allowed.", "have": current_position.get(symbol, 0), "want_to_sell": amount, "symbol": symbol, "date": today_date}
+
+        # Step 5: Execute sell operation, update position
+        # Build the new position in one pass without modifying original data:
+        # decrease stock position quantity and increase cash balance by sell price × sell quantity
+        # Use get method to ensure CASH field exists, default to 0 if not present
+        new_position = {**current_position, symbol: current_position[symbol] - amount, "CASH": current_position.get("CASH", 0) + this_symbol_price * amount}
+
+        # Step 6: Record transaction to position.jsonl file
+        # Records are appended to {project_root}/data/agent_data/{signature}/position/position.jsonl
+        # Each operation ID increments by 1, ensuring uniqueness of operation sequence
+        # JSON format transaction record, containing date, operation ID and updated position
+        record = {"date": today_date, "id": current_action_id + 1, "this_action":{"action":"sell","symbol":symbol,"amount":amount},"positions": new_position}
+        _append_records(signature, [record])
+        _store_position_snapshot(signature, today_date, new_position, current_action_id + 1)
 
     # Step 7: Return updated position
-    write_config_value("IF_TRADE", True)
+    _mark_traded(signature, today_date)
     return new_position
 
+@mcp.tool()
+def trade_batch(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Batch trade function
+    
+    This function simulates several buy/sell operations in one call, including the following steps:
+    1. Get stock opening prices for the day
+    2. Get current position and operation ID
+    3. Validate and apply each order in turn against the running position
+    4. Record all executed transactions to position.jsonl file with a single write
+    
+    Orders are applied in the given order; an order that fails validation is skipped
+    and does not affect the others.
+    
+    Args:
+        orders: List of orders, each like {"symbol": "AAPL", "amount": 10, "side": "buy"};
+            side is "buy" or "sell", amount must be a positive integer
+        
+    Returns:
+        Dict[str, Any]:
+          - "results": one entry per order, the order with "status": "filled",
+            or {"error": error message, ...} if it was skipped
+          - "positions": position after all executed orders
+        
+    Raises:
+        ValueError: Raised when SIGNATURE environment variable is not set,
+            or when the new position would contain a non-finite value
+        
+    Example:
+        >>> result = trade_batch([{"symbol": "AAPL", "amount": 10, "side": "buy"}, {"symbol": "MSFT", "amount": 5, "side": "sell"}])
+        >>> print(result["positions"])  # {"AAPL": 110, "MSFT": 0, "CASH": 6500.0, ...}
+    """
+    signature = get_config_value("SIGNATURE")
+    if signature is None:
+        raise ValueError("SIGNATURE environment variable is not set")
+    today_date = get_config_value("TODAY_DATE")
+    
+    # Step 1: Get stock opening prices for the day, outside the lock
+    try:
+        prices = _prices_for_day(today_date)
+    except KeyError:
+        prices = {}
+    
+    results: List[Dict[str, Any]] = []
+    records: List[Dict[str, Any]] = []
+    with _position_lock(signature):
+        # Step 2: Get current latest position and operation ID
+        try:
+            position, action_id = _latest_position(today_date, signature)
+        except Exception as e:
+            return {"error": f"Failed to load latest position: {e}", "date": today_date}
+        
+        # Step 3: Validate and apply each order against the running position
+        for order in orders:
+            if not isinstance(order, dict):
+                results.append({"error": f"Invalid order {order!r}! Each order must be an object with symbol, amount and side.", "date": today_date})
+                continue
+            symbol = order.get("symbol")
+            amount = order.get("amount")
+            side = order.get("side")
+            if not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0:
+                results.append({"error": f"Invalid amount {amount!r}! Amount must be a positive integer.", "symbol": symbol, "date": today_date})
+                continue
+            this_symbol_price = prices.get(f'{symbol}_price')
+            if side not in ("buy", "sell"):
+                results.append({"error": f"Unknown side {side}! Use 'buy' or 'sell'.", "symbol": symbol, "date": today_date})
+                continue
+            if this_symbol_price is None:
+                results.append({"error": f"Symbol {symbol} not found! This action will not be allowed.", "symbol": symbol, "date": today_date})
+                continue
+            
+            if side == "buy":
+                cash_left = position.get("CASH", 0) - this_symbol_price * amount
+                if cash_left < 0:
+                    results.append({"error": "Insufficient cash! This action will not be allowed.", "required_cash": this_symbol_price * amount, "cash_available": position.get("CASH", 0), "symbol": symbol, "date": today_date})
+                    continue
+                position = {**position, "CASH": cash_left, symbol: position.get(symbol, 0) + amount}
+            else:
+                if symbol not in position:
+                    results.append({"error": f"No position for {symbol}! This action will not be allowed.", "symbol": symbol, "date": today_date})
+                    continue
+                if position[symbol] < amount:
+                    results.append({"error": "Insufficient shares! This action will not be allowed.", "have": position.get(symbol, 0), "want_to_sell": amount, "symbol": symbol, "date": today_date})
+                    continue
+                position = {**position, symbol: position[symbol] - amount, "CASH": position.get("CASH", 0) + this_symbol_price * amount}
+            
+            action_id += 1
+            records.append({"date": today_date, "id": action_id, "this_action":{"action":side,"symbol":symbol,"amount":amount},"positions": position})
+            results.append({"symbol": symbol, "amount": amount, "side": side, "status": "filled", "price": this_symbol_price})
+        
+        # Step 4: Record all executed transactions with one write
+        if records:
+            _append_records(signature, records)
+            _store_position_snapshot(signature, today_date, position, action_id)
+    
+    if records:
+        _mark_traded(signature, today_date)
+    # With no executed order, position is still the (possibly shared) snapshot
+    return {"results": results, "positions": dict(position)}
+
 if __name__ == "__main__":
     # new_result = buy("AAPL", 1)
     # print(new_result)
@@ -125,18 +125,18 @@ def get_yesterday_date(today_date: str, merged_path: Optional[str] = None) -> st
         return previous_timestamp.strftime("%Y-%m-%d %H:%M:%S")
 
 
-def get_open_prices(today_date: str, symbols: List[str], merged_path: Optional[str] = None) -> Dict[str, Optional[float]]:
+def get_open_prices(today_date: str, symbols: Optional[List[str]], merged_path: Optional[str] = None) -> Dict[str, Optional[float]]:
     """从 data/merged.jsonl 中读取指定日期与标的的开盘价。
 
     Args:
         today_date: 日期字符串，格式 YYYY-MM-DD或YYYY-MM-DD HH:MM:SS。
-        symbols: 需要查询的股票代码列表。
+        symbols: 需要查询的股票代码列表；为 None 时读取文件中的全部标的。
         merged_path: 可选，自定义 merged.jsonl 路径；默认读取项目根目录下 data/merged.jsonl。
 
     Returns:
         {symbol_price: open_price 或 None} 的字典；若未找到对应日期或标的，则值为 None。
     """
-    wanted = set(symbols)
+    wanted = set(symbols) if symbols is not None else None
     results: Dict[str, Optional[float]] = {}
 
     if merged_path is None:
@@ -158,7 +158,7 @@ def get_open_prices(today_date: str, symbols: List[str], merged_path: Optional[s
                 continue
             meta = doc.get("Meta Data", {}) if isinstance(doc, dict) else {}
             sym = meta.get("2. Symbol")
-            if sym not in wanted:
+            if sym is None or (wanted is not None and sym not in wanted):
                 continue
             # 查找所有以 "Time Series" 开头的键
             series = None
@@ -375,49 +375,35 @@ def get_latest_position(today_date: str, signature: str) -> Tuple[Dict[str, floa
 
     if not position_file.exists():
         return {}, -1
-    
-    # 先尝试读取当天记录
-    max_id_today = -1
-    latest_positions_today: Dict[str, float] = {}
-    
+
+    # 单次扫描文件，按日期记录 id 最大的持仓：{date: (max_id, positions)}
+    latest_by_date: Dict[str, Tuple[int, Dict[str, float]]] = {}
+
     with position_file.open("r", encoding="utf-8") as f:
         for line in f:
             if not line.strip():
                 continue
             try:
                 doc = json.loads(line)
-                if doc.get("date") == today_date:
-                    current_id = doc.get("id", -1)
-                    if current_id > max_id_today:
-                        max_id_today = current_id
-                        latest_positions_today = doc.get("positions", {})
+                date = doc.get("date")
+                current_id = doc.get("id", -1)
+                if current_id > latest_by_date.get(date, (-1, None))[0]:
+                    latest_by_date[date] = (current_id, doc.get("positions", {}))
             except Exception:
                 continue
-    
-    if max_id_today >= 0:
+
+    # 先尝试读取当天记录
+    if today_date in latest_by_date:
+        max_id_today, latest_positions_today = latest_by_date[today_date]
         return latest_positions_today, max_id_today
 
     # 当天没有记录，则回退到上一个交易日
     prev_date = get_yesterday_date(today_date)
-    
-    max_id_prev = -1
-    latest_positions_prev: Dict[str, float] = {}
+    if prev_date in latest_by_date:
+        max_id_prev, latest_positions_prev = latest_by_date[prev_date]
+        return latest_positions_prev, max_id_prev
 
-    with position_file.open("r", encoding="utf-8") as f:
-        for line in f:
-            if not line.strip():
-                continue
-            try:
-                doc = json.loads(line)
-                if doc.get("date") == prev_date:
-                    current_id = doc.get("id", -1)
-                    if current_id > max_id_prev:
-                        max_id_prev = current_id
-                        latest_positions_prev = doc.get("positions", {})
-            except Exception:
-                continue
-    
-    return latest_positions_prev, max_id_prev
+    return {}, -1
 
 def add_no_trade_record(today_date: str, signature: str):
     """